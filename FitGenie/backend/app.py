@@ -1,15 +1,23 @@
 import os
 import uuid
-import time
-import json
 import logging
-from datetime import date, datetime, timedelta
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
 from bson import ObjectId
+from bson.errors import InvalidId
 
-from flask import Flask, request, jsonify, Response
+import orjson
+from cachetools import TTLCache
+from flask import Flask, g, request, jsonify, Response
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError, ServerSelectionTimeoutError
+from pymongo import MongoClient, ReturnDocument, WriteConcern
+from pymongo.errors import (
+    DuplicateKeyError, OperationFailure, PyMongoError, ServerSelectionTimeoutError
+)
 from dotenv import load_dotenv
 
 # Optional TLS CA bundle for MongoDB Atlas
@@ -25,9 +33,10 @@ from flask_jwt_extended import (
 )
 
 # --- project modules ---
+from indexes import IndexSetupError, ensure_indexes
 from models import user_doc, sensordata_doc, feedback_doc
 from rules import BehaviorModel
-from system_function import generate_plan, generate_nudges
+from system_function import build_plan, generate_plan, generate_nudges, plan_upsert
 
 # ----------------- logging -----------------
 logging.basicConfig(level=logging.INFO)
@@ -38,16 +47,51 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME", "ai_fitness")
 
+_IS_ATLAS = bool(MONGO_URI) and (MONGO_URI.startswith("mongodb+srv://") or "mongodb.net" in MONGO_URI)
+
+# built once at import (TLS for Atlas); make_client() just unpacks it
+_CLIENT_KWARGS = {
+    "serverSelectionTimeoutMS": 30000,
+    # per process: sized for gevent workers keeping many requests in flight.
+    # workers x MONGO_MAX_POOL must stay under the cluster's connection limit.
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL", 200)),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL", 20)),
+    "maxIdleTimeMS": 60000,
+    "retryWrites": True,
+    # wire compression; the server picks the first one it supports
+    "compressors": "zstd,zlib",
+    **({"tls": True} if _IS_ATLAS else {}),
+    **({"tlsCAFile": _CERT_PATH} if _IS_ATLAS and _CERT_PATH else {}),
+}
+
 def make_client(uri: str) -> MongoClient:
-    """Create a Mongo client with TLS for Atlas."""
-    kwargs = {"serverSelectionTimeoutMS": 30000}
-    if uri.startswith("mongodb+srv://") or "mongodb.net" in uri:
-        kwargs["tls"] = True
-        if _CERT_PATH:
-            kwargs["tlsCAFile"] = _CERT_PATH
-    return MongoClient(uri, **kwargs)
+    """Create a Mongo client for MONGO_URI with the precomputed options."""
+    return MongoClient(uri, **_CLIENT_KWARGS)
+
+def _json_default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+def _json_bytes(obj) -> bytes:
+    # Mongo hands back naive UTC datetimes; tag them +00:00 so browsers don't read them as local time
+    return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NAIVE_UTC)
+
+class OrjsonProvider(JSONProvider):
+    """C-encoded JSON; datetime/date serialise natively to ISO 8601, so handlers skip .isoformat()."""
+
+    def dumps(self, obj, **kwargs):
+        return _json_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(_json_bytes(obj), mimetype="application/json")
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # JWT (optional)
@@ -57,75 +101,125 @@ jwt = JWTManager(app)
 
 client = make_client(MONGO_URI)
 db = client[DB_NAME]
+# fire-and-forget handle for opt-in bulk telemetry (?fast_insert=1); everything else is acknowledged
+sensordata_fast = db.get_collection("sensordata", write_concern=WriteConcern(w=0))
+INGEST_CHUNK = 1000  # docs per insert_many, keeps each wire message small
 
 behavior = BehaviorModel(db)
 
 # ----------------- helpers -----------------
 def get_user_id() -> str:
-    """Prefer JWT identity; else X-User-Id; else stable dev fallback."""
-    identity = get_jwt_identity()
-    if identity:
-        return identity
-    user_id = request.headers.get("X-User-Id")
+    """Prefer JWT identity; else X-User-Id; else stable dev fallback. Memoized on `g`."""
+    if "user_id" in g:
+        return g.user_id
+    user_id = get_jwt_identity()
+    if not user_id:
+        user_id = request.headers.get("X-User-Id")
     if not user_id:
         user_id = "U123"  # stable fallback for dev/demo
         logger.warning("No auth provided; using fallback userId U123")
+    g.user_id = user_id
     return user_id
 
+# Short-lived cache of user docs. Only docs that already exist are cached, and
+# nothing rewrites a user doc after /auth/login inserts it, so a hit in one
+# worker can't go stale behind a write served by another. Plans, goals and
+# videos are written by their owners and are always read from Mongo.
+_user_cache = TTLCache(maxsize=10_000, ttl=5)
+_user_cache_lock = threading.Lock()
+
+def _get_user(user_id: str):
+    with _user_cache_lock:
+        user = _user_cache.get(user_id)
+    if user is None:
+        user = db.users.find_one({"userId": user_id})
+        if user is None:  # not stored yet; don't cache the placeholder
+            return user_doc(user_id, now=request_now())
+        with _user_cache_lock:
+            _user_cache[user_id] = user
+    return user
+
+def request_now() -> datetime:
+    """Aware UTC timestamp for the current request, read once and memoized on `g`."""
+    if "now" in g:
+        return g.now
+    g.now = datetime.now(timezone.utc)
+    return g.now
+
+def get_user_doc():
+    """The current user's doc, looked up at most once per request."""
+    if "user" not in g:
+        g.user = _get_user(get_user_id())
+    return g.user
+
 def _normalize_plan_doc(doc):
     """Return a JSON-safe plan dict."""
     if not doc:
         return doc
     d = dict(doc)
     d.pop("_id", None)
-    for k in ("date", "ts", "startedAt"):
-        if isinstance(d.get(k), (datetime, date)):
-            d[k] = d[k].isoformat()
     return d
 
-def video_doc(user_id: str, title: str, url: str, tags=None):
+# Response schemas for the list endpoints. The projected cursor docs are
+# serialised as-is, so no per-row dict is rebuilt in Python.
+METRIC_FIELDS = {"_id": 0, "metricType": 1, "value": 1, "ts": 1}
+REC_FIELDS = {"_id": 0, "message": 1, "ts": 1, "context": 1}
+VIDEO_FIELDS = {"_id": 0, "id": 1, "title": 1, "url": 1, "tags": 1, "ts": 1}
+
+def _stream_json_array(cur):
+    """Stream a cursor as a JSON array, encoding one row at a time."""
+    # pull the first row here so connection errors still surface in the caller's try
+    first = next(cur, None)
+
+    def rows():
+        if first is None:
+            yield b"[]"
+            return
+        yield b"[" + _json_bytes(first)
+        for d in cur:
+            yield b"," + _json_bytes(d)
+        yield b"]"
+
+    return Response(rows(), mimetype="application/json")
+
+def video_doc(user_id: str, title: str, url: str, tags=None, ts=None):
     return {
         "id": str(uuid.uuid4()),
         "userId": user_id,
         "title": title,
         "url": url,
         "tags": tags or [],
-        "ts": datetime.now(datetime.UTC),
+        "ts": ts or request_now(),
     }
 
-def ensure_indexes():
-    try:
-        db.sensordata.create_index([("userId", 1), ("metricType", 1), ("ts", -1)])
-        db.plans.create_index([("userId", 1), ("date", 1)])
-        db.goals.create_index([("userId", 1), ("createdAt", -1)])
-        db.recommendations.create_index([("userId", 1), ("ts", -1)])
-        db.videos.create_index([("id", 1)], unique=True)
-    except Exception as e:
-        logger.warning(f"Failed to create indexes: {e}")
-
 # ----------------- seed workout videos -----------------
 def seed_videos_if_empty():
-    if db.videos.count_documents({}) > 0:
+    # only need "is it empty?" -- a single index probe, not a full count
+    if db.videos.find_one({}, {"_id": 1}) is not None:
         return
+    now = datetime.now(timezone.utc)
     seed = [
         {"id": "vid-hand", "userId": "system", "title": "Hand Workout",
-         "url": "https://youtu.be/dCtwWNTnOq4?si=SdnfaFW4FoTPY0mQ", "tags": ["hand","arms"], "ts": datetime.now(datetime.UTC)},
+         "url": "https://youtu.be/dCtwWNTnOq4?si=SdnfaFW4FoTPY0mQ", "tags": ["hand","arms"], "ts": now},
         {"id": "vid-leg", "userId": "system", "title": "Leg Workout",
-         "url": "https://youtu.be/ZZI__bqlBkQ?si=-EKIMAmKT1irFzQB", "tags": ["legs","lowerbody"], "ts": datetime.now(datetime.UTC)},
+         "url": "https://youtu.be/ZZI__bqlBkQ?si=-EKIMAmKT1irFzQB", "tags": ["legs","lowerbody"], "ts": now},
         {"id": "vid-chest", "userId": "system", "title": "Chest Workout",
-         "url": "https://youtu.be/Qv4AvwQq5ok?si=GhPuNYhpGu2gM5S2", "tags": ["chest","upperbody"], "ts": datetime.now(datetime.UTC)},
+         "url": "https://youtu.be/Qv4AvwQq5ok?si=GhPuNYhpGu2gM5S2", "tags": ["chest","upperbody"], "ts": now},
         {"id": "vid-shoulder", "userId": "system", "title": "Shoulder Workout",
-         "url": "https://youtu.be/mUI4hXTmAkw?si=T1WzHASxkyjzFOi7", "tags": ["shoulder","upperbody"], "ts": datetime.now(datetime.UTC)},
+         "url": "https://youtu.be/mUI4hXTmAkw?si=T1WzHASxkyjzFOi7", "tags": ["shoulder","upperbody"], "ts": now},
         {"id": "vid-mobility-10", "userId": "system", "title": "10-Minute Morning Mobility",
-         "url": "https://www.youtube.com/watch?v=Z4ziWoIo6lM", "tags": ["mobility","stretch"], "ts": datetime.now(datetime.UTC)},
+         "url": "https://www.youtube.com/watch?v=Z4ziWoIo6lM", "tags": ["mobility","stretch"], "ts": now},
         {"id": "vid-hiit-20", "userId": "system", "title": "20-Minute Full Body HIIT",
-         "url": "https://www.youtube.com/watch?v=ml6cT4AZdqI", "tags": ["hiit","cardio"], "ts": datetime.now(datetime.UTC)},
+         "url": "https://www.youtube.com/watch?v=ml6cT4AZdqI", "tags": ["hiit","cardio"], "ts": now},
     ]
-    db.videos.insert_many(seed)
+    # unordered: a worker racing us to seed only collides on the ids it also inserts
+    db.videos.insert_many(seed, ordered=False)
 
 try:
-    ensure_indexes()
+    ensure_indexes(db)
     seed_videos_if_empty()
+except IndexSetupError:
+    raise  # plan/goal upserts rely on these; don't serve without them
 except Exception as se:
     logger.warning(f"[Startup] Issue: {se}")
 
@@ -136,32 +230,52 @@ def handle_exception(e):
     return jsonify({"success": False, "error": str(e)}), 500
 
 # ----------------- routes -----------------
+# static, so encoded once at import
+ROOT_JSON = _json_bytes({
+    "service": "ai-fitness-backend",
+    "ok": True,
+    "endpoints": [
+        "/health", "/auth/login", "/me",
+        "/me/metrics", "/me/metrics/steps",
+        "/me/plan", "/me/plan/start", "/me/plan/complete",
+        "/me/plan/week", "/me/plan/week/regenerate",
+        "/me/plan/<YYYY-MM-DD>/start", "/me/plan/<YYYY-MM-DD>/complete",
+        "/me/recommendations", "/me/nudge", "/me/feedback",
+        "/coach/ask", "/stream/nudges",
+        "/videos (GET/POST)", "/videos/delete (POST)",
+        "/me/goals (GET/POST)", "/me/goals/<id> (PATCH/DELETE)",
+    ]
+})
+
 @app.get("/")
 def root():
-    return {
-        "service": "ai-fitness-backend",
-        "ok": True,
-        "endpoints": [
-            "/health", "/auth/login", "/me",
-            "/me/metrics", "/me/metrics/steps",
-            "/me/plan", "/me/plan/start", "/me/plan/complete",
-            "/me/plan/week", "/me/plan/week/regenerate",
-            "/me/plan/<YYYY-MM-DD>/start", "/me/plan/<YYYY-MM-DD>/complete",
-            "/me/recommendations", "/me/nudge", "/me/feedback",
-            "/coach/ask", "/stream/nudges",
-            "/videos (GET/POST)", "/videos/delete (POST)",
-            "/me/goals (GET/POST)", "/me/goals/<id> (PATCH/DELETE)",
-        ]
-    }
+    return Response(ROOT_JSON, mimetype="application/json")
+
+# Last ping result, reused for HEALTH_TTL_S so frequent probes don't each hit Mongo.
+HEALTH_TTL_S = 2.0
+_health = {"ts": 0.0, "status": "ok"}
+_health_lock = threading.Lock()
+
+def _db_status():
+    if time.monotonic() - _health["ts"] < HEALTH_TTL_S:
+        return _health["status"]
+    # one prober at a time; concurrent checks get the last known status instead of queueing
+    if not _health_lock.acquire(blocking=False):
+        return _health["status"]
+    try:
+        try:
+            client.admin.command("ping")
+            status = "ok"
+        except Exception:
+            status = "degraded"
+        _health.update(ts=time.monotonic(), status=status)
+        return status
+    finally:
+        _health_lock.release()
 
 @app.get("/health")
 def health():
-    status = "ok"
-    try:
-        client.admin.command("ping")
-    except Exception:
-        status = "degraded"
-    return {"status": status, "time": datetime.now(datetime.UTC).isoformat()}
+    return {"status": _db_status(), "time": request_now().isoformat()}
 
 # --- auth / user ---
 @app.post("/auth/login")
@@ -175,7 +289,7 @@ def login():
     name = body.get("name", "Demo User")
     try:
         if not db.users.find_one({"userId": user_id}):
-            db.users.insert_one(user_doc(user_id, name))
+            db.users.insert_one(user_doc(user_id, name, now=request_now()))
         token = create_access_token(identity=user_id)
         return {"userId": user_id, "name": name, "access_token": token}
     except (PyMongoError, ServerSelectionTimeoutError) as e:
@@ -186,7 +300,7 @@ def login():
 def me():
     user_id = get_user_id()
     try:
-        user = db.users.find_one({"userId": user_id}) or user_doc(user_id)
+        user = get_user_doc()
         return {"userId": user_id, "name": user.get("name", "Demo User")}
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
@@ -195,25 +309,33 @@ def me():
 @app.post("/me/metrics")
 @jwt_required(optional=True)
 def ingest_metrics():
-    """Insert metrics samples (HR, Steps, SleepScore, etc.)."""
+    """
+    Insert metrics samples (HR, Steps, SleepScore, etc.).
+    Writes are acknowledged by default, so a read right after sees them.
+    Bulk feeds that never read back (scripts/sensor_sim.py) can pass
+    ?fast_insert=1 to skip the ack; the reply then can't vouch for the count.
+    """
     user_id = get_user_id()
+    fast = request.args.get("fast_insert", "0").lower() in ("1", "true", "yes")
     payload = request.json
     if payload is None:
         return jsonify({"error": "invalid_json"}), 400
 
     items = payload if isinstance(payload, list) else [payload]
+    now = request_now()
     docs = []
     for m in items:
         mt = (m or {}).get("metricType")
         val = (m or {}).get("value")
         if mt is None or val is None:
             return jsonify({"error": "missing_fields", "detail": "metricType and value required"}), 400
-        docs.append(sensordata_doc(user_id, mt, val))
+        docs.append(sensordata_doc(user_id, mt, val, ts=now))
 
     try:
-        if docs:
-            db.sensordata.insert_many(docs)
-        return {"ingested": len(docs)}
+        coll = sensordata_fast if fast else db.sensordata
+        for i in range(0, len(docs), INGEST_CHUNK):
+            coll.insert_many(docs[i:i + INGEST_CHUNK], ordered=False)
+        return {"ingested": len(docs), "acknowledged": not fast}
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
@@ -227,43 +349,77 @@ def set_steps():
     today = date.today().isoformat()
 
     # use models.sensordata_doc day-level rollup
-    doc = sensordata_doc(user_id, "Steps", steps, date_str=today)
+    doc = sensordata_doc(user_id, "Steps", steps, ts=request_now(), date_str=today)
+
+    # only value/ts change between calls; the keyed fields are written once on insert
+    mutable = {"value": doc.pop("value"), "ts": doc.pop("ts")}
 
     try:
         db.sensordata.update_one(
             {"userId": user_id, "metricType": "Steps", "date": today},
-            {"$set": doc},
+            {"$set": mutable, "$setOnInsert": doc},
             upsert=True
         )
         return {"ok": True, "steps": steps, "date": today}
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
+METRICS_MAX_LIMIT = 1000
+
 @app.get("/me/metrics")
 @jwt_required(optional=True)
 def list_metrics():
     user_id = get_user_id()
+    # rows are streamed, so a larger page doesn't grow the response in memory
     try:
-        cur = db.sensordata.find({"userId": user_id}).sort("ts", -1).limit(50)
-        return jsonify([
-            {"metricType": d["metricType"], "value": d["value"], "ts": d["ts"].isoformat()}
-            for d in cur
-        ])
+        limit = min(max(int(request.args.get("limit", 50)), 1), METRICS_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "bad_limit", "detail": "limit must be an integer"}), 400
+    try:
+        # no hint: the ts sort already steers the planner to (userId, ts), and a hint
+        # would fail every request if ensure_indexes couldn't build that index
+        cur = db.sensordata.find({"userId": user_id}, METRIC_FIELDS).sort("ts", -1).limit(limit)
+        return _stream_json_array(cur)
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
 # --- daily plan ---
+# A user's first read of the day builds the plan off the request path;
+# _plans_pending dedupes polls that arrive while it is still running.
+_plan_jobs = ThreadPoolExecutor(max_workers=4, thread_name_prefix="plan-gen")
+_plans_pending = set()
+_plans_pending_lock = threading.Lock()
+
+def _schedule_plan(user, today: str):
+    key = (user["userId"], today)
+    with _plans_pending_lock:
+        if key in _plans_pending:
+            return
+        _plans_pending.add(key)
+
+    def job():
+        try:
+            generate_plan(user, behavior, db)  # stores today's plan itself
+        except Exception as e:
+            logger.warning(f"Background plan generation failed for {key[0]}: {e}")
+        finally:
+            with _plans_pending_lock:
+                _plans_pending.discard(key)
+
+    _plan_jobs.submit(job)
+
 @app.get("/me/plan")
 @jwt_required(optional=True)
 def get_plan():
+    """Today's plan; 202 {"status": "generating"} while a missing one is being built."""
     user_id = get_user_id()
     today = date.today().isoformat()
     try:
-        raw = db.plans.find_one({"userId": user_id, "date": today}, {"_id": 0})
-        if not raw:
-            user = db.users.find_one({"userId": user_id}) or user_doc(user_id)
-            raw = generate_plan(user, behavior, db)
-        return jsonify(_normalize_plan_doc(raw))
+        plan = db.plans.find_one({"userId": user_id, "date": today}, {"_id": 0})
+        if plan is None:
+            _schedule_plan(get_user_doc(), today)
+            return jsonify({"status": "generating"}), 202
+        return jsonify(_normalize_plan_doc(plan))
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
@@ -273,12 +429,13 @@ def start_plan():
     user_id = get_user_id()
     today = date.today().isoformat()
     try:
-        db.plans.update_one(
+        doc = db.plans.find_one_and_update(
             {"userId": user_id, "date": today},
-            {"$set": {"status": "In Progress", "startedAt": datetime.now(datetime.UTC)}},
-            upsert=True
+            {"$set": {"status": "In Progress", "startedAt": request_now()}},
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
-        doc = db.plans.find_one({"userId": user_id, "date": today}, {"_id": 0})
         return jsonify(_normalize_plan_doc(doc))
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
@@ -294,54 +451,84 @@ def complete_plan():
             {"$set": {"status": "Completed"}},
             upsert=True
         )
+        behavior.invalidate(user_id)  # adherence changed
         return {"status": "Completed"}
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
 # --- week planning ---
-def _upsert_plan_for_date(user_id: str, the_date: date):
-    user = db.users.find_one({"userId": user_id}) or user_doc(user_id)
-    plan = generate_plan(user, behavior, db)  # dict
-    d = dict(plan)
-    d["userId"] = user_id
-    d["date"] = the_date.isoformat()
-    d.pop("_id", None)
-    db.plans.update_one(
+def _plan_for_date(user, the_date: date):
+    """Build (but don't store) the plan dict for one user/day; the caller does the only write."""
+    plan, _ = build_plan(user, behavior, the_date.isoformat())
+    return plan
+
+def _plans_for_dates(user, dates):
+    """
+    Build (but don't store) plans for several days from one intensity lookup.
+    Intensity depends on the user's recent behaviour, not on the target day,
+    so the first plan is reused as the template for the others.
+    """
+    template = _plan_for_date(user, dates[0])
+    out = [template]
+    for dy in dates[1:]:
+        d = dict(template, date=dy.isoformat())
+        d["items"] = [dict(it) for it in template.get("items", [])]
+        out.append(d)
+    return out
+
+def _upsert_plan_for_date(user_id: str, the_date: date, user, **fields):
+    """
+    Generate and store one day's plan; `user` is the caller's already-fetched user doc.
+    Extra `fields` (e.g. status) override the generated ones in the same write.
+    Returns the stored doc.
+    """
+    d = _plan_for_date(user, the_date)
+    d.update(fields)
+    return db.plans.find_one_and_update(
         {"userId": user_id, "date": d["date"]},
         {"$set": d},
-        upsert=True
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
     )
-    return d
+
+def _week_dates():
+    today = date.today()
+    return [today + timedelta(days=i) for i in range(7)]
 
 @app.get("/me/plan/week")
 @jwt_required(optional=True)
 def get_week_plan():
     """Return plans for today + next 6 days; generate missing ones."""
     user_id = get_user_id()
-    today = date.today()
-    out = []
+    dates = _week_dates()
+    iso_dates = [dy.isoformat() for dy in dates]
     try:
-        for i in range(7):
-            dy = today + timedelta(days=i)
-            existing = db.plans.find_one({"userId": user_id, "date": dy.isoformat()}, {"_id": 0})
-            if not existing:
-                existing = _upsert_plan_for_date(user_id, dy)
-            out.append(_normalize_plan_doc(existing))
-        return jsonify(out)
+        # one read for the whole week, one bulk write for whatever is missing;
+        # ISO dates sort lexicographically, so the week is one contiguous index range
+        cur = db.plans.find(
+            {"userId": user_id, "date": {"$gte": iso_dates[0], "$lte": iso_dates[-1]}},
+            {"_id": 0}
+        )
+        existing = {p["date"]: p for p in cur}
+        missing = [dy for dy, ds in zip(dates, iso_dates) if ds not in existing]
+        if missing:
+            user = get_user_doc()
+            generated = _plans_for_dates(user, missing)
+            db.plans.bulk_write([plan_upsert(d) for d in generated], ordered=False)
+            existing.update((d["date"], d) for d in generated)
+        return jsonify([_normalize_plan_doc(existing[ds]) for ds in iso_dates])
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
 @app.post("/me/plan/week/regenerate")
 @jwt_required(optional=True)
 def regenerate_week_plan():
-    user_id = get_user_id()
-    today = date.today()
-    out = []
     try:
-        for i in range(7):
-            dy = today + timedelta(days=i)
-            out.append(_normalize_plan_doc(_upsert_plan_for_date(user_id, dy)))
-        return jsonify({"ok": True, "plans": out})
+        user = get_user_doc()
+        plans = _plans_for_dates(user, _week_dates())
+        db.plans.bulk_write([plan_upsert(d) for d in plans], ordered=False)
+        return jsonify({"ok": True, "plans": [_normalize_plan_doc(d) for d in plans]})
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
@@ -351,13 +538,12 @@ def start_plan_on_date(the_date):
     user_id = get_user_id()
     try:
         y, m, d = map(int, the_date.split("-"))
-        _upsert_plan_for_date(user_id, date(y, m, d))
-        db.plans.update_one(
-            {"userId": user_id, "date": the_date},
-            {"$set": {"status": "In Progress", "startedAt": datetime.now(datetime.UTC)}},
-            upsert=True
+        user = get_user_doc()
+        # regenerate and start in a single write
+        doc = _upsert_plan_for_date(
+            user_id, date(y, m, d), user,
+            status="In Progress", startedAt=request_now()
         )
-        doc = db.plans.find_one({"userId": user_id, "date": the_date}, {"_id": 0})
         return jsonify(_normalize_plan_doc(doc))
     except (ValueError, PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "bad_date_or_db", "detail": str(e)}), 400
@@ -367,12 +553,14 @@ def start_plan_on_date(the_date):
 def complete_plan_on_date(the_date):
     user_id = get_user_id()
     try:
-        db.plans.update_one(
+        doc = db.plans.find_one_and_update(
             {"userId": user_id, "date": the_date},
             {"$set": {"status": "Completed"}},
-            upsert=True
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
-        doc = db.plans.find_one({"userId": user_id, "date": the_date}, {"_id": 0})
+        behavior.invalidate(user_id)  # adherence changed
         return jsonify(_normalize_plan_doc(doc))
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
@@ -383,11 +571,8 @@ def complete_plan_on_date(the_date):
 def get_recs():
     user_id = get_user_id()
     try:
-        cur = db.recommendations.find({"userId": user_id}).sort("ts", -1).limit(20)
-        return jsonify([
-            {"message": r["message"], "ts": r["ts"].isoformat(), "context": r.get("context", "")}
-            for r in cur
-        ])
+        cur = db.recommendations.find({"userId": user_id}, REC_FIELDS).sort("ts", -1).limit(20)
+        return jsonify(list(cur))
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
@@ -397,7 +582,9 @@ def make_nudge():
     user_id = get_user_id()
     try:
         rec = generate_nudges(user_id, behavior, db)
-        return {"message": rec["message"], "ts": rec["ts"].isoformat()}
+        if not _nudge_feed_live.is_set():
+            publish_nudge(user_id, rec["message"])  # no change stream to deliver it
+        return {"message": rec["message"], "ts": rec["ts"]}
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
@@ -413,7 +600,8 @@ def give_feedback():
             rpe=body.get("rpe"),
             mood=body.get("mood"),
             pain=body.get("pain", "none"),
-            notes=body.get("notes", "")
+            notes=body.get("notes", ""),
+            ts=request_now()
         )
         db.feedback.insert_one(doc)
         return {"ok": True}
@@ -421,6 +609,12 @@ def give_feedback():
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
 # --- AI Coach ---
+_COACH_TEMPLATE = (
+    "I hear you, {user}. From what you shared — “{msg}” — "
+    "try a light 20-minute walk, 5 minutes of breathing, and gentle mobility. "
+    "Hydrate and aim for 7–9 hours of sleep tonight."
+)
+
 @app.post("/coach/ask")
 @jwt_required(optional=True)
 def coach_ask():
@@ -433,12 +627,7 @@ def coach_ask():
     user_id = get_user_id()
     if not msg:
         return jsonify({"reply": "Tell me how you’re feeling or what you want to work on today."})
-    reply = (
-        f"I hear you, {user_id}. From what you shared — “{msg}” — "
-        "try a light 20-minute walk, 5 minutes of breathing, and gentle mobility. "
-        "Hydrate and aim for 7–9 hours of sleep tonight."
-    )
-    return jsonify({"reply": reply})
+    return jsonify({"reply": _COACH_TEMPLATE.format(user=user_id, msg=msg)})
 
 # --- Workout Videos CRUD ---
 @app.get("/videos")
@@ -446,17 +635,8 @@ def coach_ask():
 def list_videos():
     """List workout videos (latest first)."""
     try:
-        cur = db.videos.find().sort("ts", -1).limit(200)
-        out = []
-        for v in cur:
-            out.append({
-                "id": v.get("id"),
-                "title": v.get("title"),
-                "url": v.get("url"),
-                "tags": v.get("tags", []),
-                "ts": v["ts"].isoformat() if isinstance(v.get("ts"), datetime) else v.get("ts"),
-            })
-        return jsonify(out)
+        cur = db.videos.find({}, VIDEO_FIELDS).sort("ts", -1).limit(200)
+        return _stream_json_array(cur)
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
@@ -480,29 +660,27 @@ def add_or_update_video():
 
     try:
         if vid_id:
-            existing = db.videos.find_one({"id": vid_id})
-            if existing:
-                # only owner can update; protect system videos
+            if user_id == "system":
+                return jsonify({"error": "forbidden", "detail": "system videos cannot be modified"}), 403
+            # update-own-or-create in one round trip; id/userId come from the filter on insert
+            try:
+                doc = db.videos.find_one_and_update(
+                    {"id": vid_id, "userId": user_id},
+                    {"$set": {"title": title, "url": url, "tags": tags, "ts": request_now()}},
+                    projection={"_id": 0},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # the unique videos.id index says someone else owns this id
+                existing = db.videos.find_one({"id": vid_id}, {"_id": 0, "userId": 1}) or {}
                 if existing.get("userId") == "system":
                     return jsonify({"error": "forbidden", "detail": "system videos cannot be modified"}), 403
-                if existing.get("userId") != user_id:
-                    return jsonify({"error": "forbidden"}), 403
-                db.videos.update_one({"id": vid_id}, {"$set": {
-                    "title": title, "url": url, "tags": tags, "ts": datetime.now(datetime.UTC)
-                }})
-                doc = db.videos.find_one({"id": vid_id}, {"_id": 0})
-            else:
-                newdoc = video_doc(user_id, title, url, tags)
-                newdoc["id"] = vid_id
-                db.videos.insert_one(newdoc)
-                doc = {k: v for k, v in newdoc.items() if k != "_id"}
+                return jsonify({"error": "forbidden"}), 403
         else:
             newdoc = video_doc(user_id, title, url, tags)
             db.videos.insert_one(newdoc)
             doc = {k: v for k, v in newdoc.items() if k != "_id"}
-
-        if isinstance(doc.get("ts"), datetime):
-            doc["ts"] = doc["ts"].isoformat()
         return jsonify(doc)
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
@@ -515,81 +693,150 @@ def delete_video():
     vid_id = body.get("id")
     if not vid_id:
         return jsonify({"error": "missing_id"}), 400
+    user_id = get_user_id()
     try:
-        v = db.videos.find_one({"id": vid_id})
-        if not v:
-            return jsonify({"error": "not_found"}), 404
-        if v.get("userId") == "system":
-            return jsonify({"error": "forbidden", "detail": "system videos cannot be deleted"}), 403
-        if v.get("userId") != get_user_id():
+        # owner-only delete in one round trip; look closer only when nothing matched
+        deleted = None
+        if user_id != "system":
+            deleted = db.videos.find_one_and_delete({"id": vid_id, "userId": user_id}, {"_id": 1})
+        if not deleted:
+            v = db.videos.find_one({"id": vid_id}, {"_id": 0, "userId": 1})
+            if not v:
+                return jsonify({"error": "not_found"}), 404
+            if v.get("userId") == "system":
+                return jsonify({"error": "forbidden", "detail": "system videos cannot be deleted"}), 403
             return jsonify({"error": "forbidden"}), 403
-        db.videos.delete_one({"id": vid_id})
         return {"ok": True}
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
 # --- GOALS (CRUD + live progress) ---
+# Each progress source is an aggregation ending in a single {"v": value} doc, so
+# they can run alone or be stitched into one round trip by _progress_context().
+def _to_int(field):
+    # $sum skips the nulls, so bad values are ignored rather than aborting the aggregation
+    return {"$convert": {"input": field, "to": "int", "onError": None, "onNull": None}}
+
+def _steps_today_pipeline(user_id):
+    start = datetime.combine(date.today(), datetime.min.time())
+    end = start + timedelta(days=1)
+    today = start.date().isoformat()
+    value = _to_int("$value")
+    # sum the day rollup and the raw samples side by side; the rollup wins when set
+    return [
+        {"$match": {"userId": user_id, "metricType": "Steps",
+                    "$or": [{"date": today}, {"ts": {"$gte": start, "$lt": end}}]}},
+        {"$group": {
+            "_id": None,
+            "rollup": {"$sum": {"$cond": [{"$eq": ["$date", today]}, value, 0]}},
+            # fallback: sum today via ts field (older entries may not have 'date')
+            "raw": {"$sum": {"$cond": [{"$and": [{"$gte": ["$ts", start]}, {"$lt": ["$ts", end]}]}, value, 0]}},
+        }},
+        {"$project": {"_id": 0, "v": {"$cond": [{"$ne": ["$rollup", 0]}, "$rollup", "$raw"]}}},
+    ]
+
+def _active_minutes_pipeline(user_id):
+    return [
+        {"$match": {"userId": user_id, "date": date.today().isoformat()}},
+        {"$limit": 1},
+        {"$unwind": "$items"},
+        {"$match": {"items.type": "Workout"}},
+        {"$group": {"_id": None, "v": {"$sum": _to_int("$items.durationMin")}}},
+        {"$project": {"_id": 0, "v": 1}},
+    ]
+
+def _sleep_avg_pipeline(user_id, k=3):
+    return [
+        {"$match": {"userId": user_id, "metricType": "SleepScore"}},
+        {"$sort": {"ts": -1}},
+        {"$limit": k},
+        # non-numeric values drop out of the average, missing ones count as 0
+        {"$group": {"_id": None, "avg": {"$avg": {
+            "$convert": {"input": "$value", "to": "double", "onError": None, "onNull": 0.0}
+        }}}},
+        {"$project": {"_id": 0, "v": {"$round": ["$avg", 1]}}},
+    ]
+
+def _scalar(coll, pipeline, default):
+    res = next(db[coll].aggregate(pipeline), None)
+    return res["v"] if res and res.get("v") is not None else default
+
 def _steps_today(user_id):
-    today = date.today().isoformat()
-    total = 0
-    for d in db.sensordata.find({"userId": user_id, "metricType": "Steps", "date": today}):
-        total += int(d.get("value", 0))
-    if total == 0:
-        # fallback: sum today via ts field (older entries may not have 'date')
-        for d in db.sensordata.find({"userId": user_id, "metricType": "Steps"}):
-            ts = d.get("ts")
-            if isinstance(ts, datetime) and ts.date().isoformat() == today:
-                total += int(d.get("value", 0))
-    return total
+    return _scalar("sensordata", _steps_today_pipeline(user_id), 0)
 
 def _active_minutes_today_from_plan(user_id):
-    today = date.today().isoformat()
-    p = db.plans.find_one({"userId": user_id, "date": today}) or {}
-    mins = 0
-    for it in (p.get("items") or []):
-        if it.get("type") == "Workout":
-            mins += int(it.get("durationMin", 0))
-    return mins
+    return _scalar("plans", _active_minutes_pipeline(user_id), 0)
 
 def _sleep_avg_recent(user_id, k=3):
-    vals = []
-    cur = db.sensordata.find({"userId": user_id, "metricType": "SleepScore"}).sort("ts", -1).limit(k)
-    for d in cur:
-        try:
-            vals.append(float(d.get("value", 0)))
-        except:
-            pass
-    return round(sum(vals)/len(vals), 1) if vals else 0.0
-
-def _progress_for_goal(user_id, g):
-    t = float(g.get("target", 0))
-    kind = g.get("type")
-    if kind == "steps_daily":
-        got = _steps_today(user_id); unit = "steps"
-    elif kind == "active_minutes_daily":
-        got = _active_minutes_today_from_plan(user_id); unit = "min"
-    elif kind == "sleep_score_avg":
-        got = _sleep_avg_recent(user_id, 3); unit = "score"
+    return _scalar("sensordata", _sleep_avg_pipeline(user_id, k), 0.0)
+
+def _progress_context(user_id):
+    """
+    All goal-progress values in one round trip. Each $unionWith branch is its
+    own pipeline, so every source keeps using its own index.
+    """
+    def tag(kind):
+        return {"$addFields": {"k": kind}}
+
+    pipeline = _steps_today_pipeline(user_id) + [
+        tag("steps_daily"),
+        {"$unionWith": {"coll": "plans",
+                        "pipeline": _active_minutes_pipeline(user_id) + [tag("active_minutes_daily")]}},
+        {"$unionWith": {"coll": "sensordata",
+                        "pipeline": _sleep_avg_pipeline(user_id, 3) + [tag("sleep_score_avg")]}},
+    ]
+    ctx = {"steps_daily": 0, "active_minutes_daily": 0, "sleep_score_avg": 0.0}
+    for d in db.sensordata.aggregate(pipeline):
+        if d.get("v") is not None:
+            ctx[d["k"]] = d["v"]
+    return ctx
+
+# goal type -> (current value for a user, unit)
+_PROGRESS_SOURCES = {
+    "steps_daily": (_steps_today, "steps"),
+    "active_minutes_daily": (_active_minutes_today_from_plan, "min"),
+    "sleep_score_avg": (lambda uid: _sleep_avg_recent(uid, 3), "score"),
+}
+
+def _progress_for_goal(user_id, goal, ctx=None):
+    """`ctx` memoizes the per-type values so a list of goals queries each source once."""
+    t = float(goal.get("target", 0))
+    kind = goal.get("type")
+    if kind in _PROGRESS_SOURCES:
+        fn, unit = _PROGRESS_SOURCES[kind]
+        if ctx is None:
+            got = fn(user_id)
+        else:
+            if kind not in ctx:
+                ctx[kind] = fn(user_id)
+            got = ctx[kind]
     else:
         got = 0; unit = ""
     pct = 0 if t <= 0 else min(100, round(got / t * 100))
     return {"value": got, "target": t, "percent": pct, "unit": unit}
 
+def _goal_filter(user_id, gid):
+    """
+    Single-key lookup: API ids are the ObjectId hex (new goals only store _id);
+    anything else is a legacy string 'id'.
+    """
+    try:
+        return {"userId": user_id, "_id": ObjectId(gid)}
+    except (InvalidId, TypeError):
+        return {"userId": user_id, "id": gid}
+
 @app.get("/me/goals")
 @jwt_required(optional=True)
 def goals_list():
     user_id = get_user_id()
     try:
-        out = []
-        for g in db.goals.find({"userId": user_id}).sort("createdAt", -1):
-            g = dict(g)
-            g["id"] = g.get("id") or str(g["_id"])
-            g.pop("_id", None)
-            g["progress"] = _progress_for_goal(user_id, g)
-            if isinstance(g.get("createdAt"), (datetime, date)):
-                g["createdAt"] = g["createdAt"].isoformat()
-            out.append(g)
-        return jsonify(out)
+        goals = list(db.goals.find({"userId": user_id}, {"userId": 0}).sort("createdAt", -1))
+        ctx = _progress_context(user_id) if goals else {}
+        for goal in goals:
+            goal["id"] = goal.get("id") or str(goal["_id"])
+            goal.pop("_id", None)
+            goal["progress"] = _progress_for_goal(user_id, goal, ctx)
+        return jsonify(goals)
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error": "database_unreachable", "detail": str(e)}), 503
 
@@ -610,25 +857,21 @@ def goals_create():
         target = float(target)
     except:
         return jsonify({"error": "bad_target"}), 400
-    g = {
+    goal = {
         "_id": ObjectId(),
-        "id": None,
         "userId": user_id,
         "type": gtype,
         "target": target,
         "title": b.get("title", gtype.replace("_", " ").title()),
         "deadline": b.get("deadline"),
         "status": "Active",
-        "createdAt": datetime.now(datetime.UTC),
+        "createdAt": request_now(),
     }
     try:
-        g["id"] = str(g["_id"])
-        db.goals.insert_one(g)
-        g.pop("_id", None)
-        g["progress"] = _progress_for_goal(user_id, g)
-        if isinstance(g.get("createdAt"), datetime):
-            g["createdAt"] = g["createdAt"].isoformat()
-        return jsonify(g)
+        db.goals.insert_one(goal)
+        goal["id"] = str(goal.pop("_id"))
+        goal["progress"] = _progress_for_goal(user_id, goal)
+        return jsonify(goal)
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error":"database_unreachable","detail":str(e)}), 503
 
@@ -644,14 +887,16 @@ def goals_update(gid):
         try: updates["target"] = float(updates["target"])
         except: return jsonify({"error":"bad_target"}), 400
     try:
-        db.goals.update_one({"userId": user_id, "$or":[{"id":gid},{"_id":ObjectId(gid)}]}, {"$set": updates})
-        g = db.goals.find_one({"userId": user_id, "$or":[{"id":gid},{"_id":ObjectId(gid)}]})
-        if not g:
+        q = _goal_filter(user_id, gid)
+        if updates:
+            goal = db.goals.find_one_and_update(q, {"$set": updates}, return_document=ReturnDocument.AFTER)
+        else:
+            goal = db.goals.find_one(q)
+        if not goal:
             return jsonify({"error":"not_found"}), 404
-        g = dict(g); g["id"] = g.get("id") or str(g["_id"]); g.pop("_id", None)
-        g["progress"] = _progress_for_goal(user_id, g)
-        if isinstance(g.get("createdAt"), datetime): g["createdAt"] = g["createdAt"].isoformat()
-        return jsonify(g)
+        goal["id"] = goal.get("id") or str(goal["_id"]); goal.pop("_id", None)
+        goal["progress"] = _progress_for_goal(user_id, goal)
+        return jsonify(goal)
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error":"database_unreachable","detail":str(e)}), 503
 
@@ -660,25 +905,100 @@ def goals_update(gid):
 def goals_delete(gid):
     user_id = get_user_id()
     try:
-        db.goals.delete_one({"userId": user_id, "$or":[{"id":gid},{"_id":ObjectId(gid)}]})
+        db.goals.delete_one(_goal_filter(user_id, gid))
         return {"ok": True}
     except (PyMongoError, ServerSelectionTimeoutError) as e:
         return jsonify({"error":"database_unreachable","detail":str(e)}), 503
 
 # --- Real-time nudges (SSE) ---
+# Each open stream owns a queue in its worker. A nudge is an insert into
+# `recommendations`, so every worker tails that collection with one change
+# stream and fans new nudges out to its own queues; /me/nudge can be served
+# by any worker. Change streams need a replica set (Atlas always is). On a
+# standalone server the watcher gives up and make_nudge only reaches streams
+# on the worker that served it.
+NUDGE_KEEPALIVE_S = 15
+NUDGE_WATCH_RETRY_S = 5
+_NUDGE_CHANGES = [
+    {"$match": {"operationType": "insert", "fullDocument.context": "nudge"}},
+    {"$project": {"fullDocument.userId": 1, "fullDocument.message": 1}},
+]
+_nudge_subscribers = {}  # userId -> set of queue.Queue
+_nudge_lock = threading.Lock()
+_nudge_watcher = None  # started with this worker's first stream
+_nudge_feed_live = threading.Event()  # set once the change stream is open
+
+def _watch_nudges():
+    resume = None
+    while True:
+        try:
+            with db.recommendations.watch(_NUDGE_CHANGES, resume_after=resume) as changes:
+                _nudge_feed_live.set()
+                for ch in changes:
+                    resume = ch["_id"]
+                    doc = ch["fullDocument"]
+                    publish_nudge(doc["userId"], doc["message"])
+        except OperationFailure as e:
+            if resume is None:
+                _nudge_feed_live.clear()
+                logger.warning(f"Nudge change stream unavailable; nudges reach this worker's streams only: {e}")
+                return
+            resume = None  # token fell out of the oplog; carry on from now
+        except PyMongoError as e:
+            # nudges inserted meanwhile are replayed from the resume token
+            logger.warning(f"Nudge change stream dropped, retrying: {e}")
+            time.sleep(NUDGE_WATCH_RETRY_S)
+
+def _subscribe_nudges(user_id):
+    global _nudge_watcher
+    q = queue.Queue(maxsize=100)
+    with _nudge_lock:
+        _nudge_subscribers.setdefault(user_id, set()).add(q)
+        if _nudge_watcher is None:
+            _nudge_watcher = threading.Thread(target=_watch_nudges, name="nudge-watch", daemon=True)
+            _nudge_watcher.start()
+    return q
+
+def _unsubscribe_nudges(user_id, q):
+    with _nudge_lock:
+        subs = _nudge_subscribers.get(user_id)
+        if subs:
+            subs.discard(q)
+            if not subs:
+                del _nudge_subscribers[user_id]
+
+def publish_nudge(user_id, message):
+    """Hand `message` to this worker's open streams for `user_id`."""
+    with _nudge_lock:
+        subs = list(_nudge_subscribers.get(user_id, ()))
+    for q in subs:
+        try:
+            q.put_nowait(message)
+        except queue.Full:
+            pass  # slow client; drop rather than block the publisher
+
 @app.get("/stream/nudges")
 @jwt_required(optional=True)
 def stream_nudges():
     user_id = get_user_id()
     def event_stream():
-        while True:
-            time.sleep(15)
-            yield f"data: {json.dumps({'userId': user_id, 'message': 'Stand up and stretch for 1–2 minutes.'})}\n\n"
+        q = _subscribe_nudges(user_id)
+        try:
+            while True:
+                # block until a nudge is published; the periodic reminder doubles as keepalive
+                try:
+                    msg = q.get(timeout=NUDGE_KEEPALIVE_S)
+                except queue.Empty:
+                    msg = "Stand up and stretch for 1–2 minutes."
+                yield b"data: " + _json_bytes({"userId": user_id, "message": msg}) + b"\n\n"
+        finally:
+            _unsubscribe_nudges(user_id, q)
     return Response(event_stream(), mimetype="text/event-stream")
 
 # ----------------- main -----------------
+# Dev server only; deploy with `gunicorn -c gunicorn.conf.py app:app` (gevent workers).
 if __name__ == "__main__":
-    if (MONGO_URI.startswith("mongodb+srv://") or "mongodb.net" in MONGO_URI) and not _CERT_PATH:
+    if _IS_ATLAS and not _CERT_PATH:
         logger.warning("Using MongoDB Atlas but 'certifi' is not installed. "
                        "Run 'pip install certifi' to avoid TLS errors.")
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,21 @@
+# Production server config: gunicorn -c gunicorn.conf.py app:app
+#
+# Every route is I/O-bound on MongoDB, so each worker runs gevent green
+# threads instead of one OS thread per request. gunicorn monkey-patches the
+# stdlib before loading app.py, which makes pymongo's sockets (and the
+# queue waits in /stream/nudges) cooperative; one worker can keep hundreds
+# of Mongo calls in flight.
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", min(4, multiprocessing.cpu_count())))
+worker_class = "gevent"
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", 500))
+# gevent workers heartbeat from their own loop, so open SSE streams never trip
+# this; it only restarts a worker wedged in a blocking call or a CPU loop
+timeout = int(os.getenv("WORKER_TIMEOUT", 30))
+keepalive = 5
+# app.py opens its MongoClient at import; load it in each worker after the
+# fork (pymongo clients are not fork-safe), one pool per worker process.
+preload_app = False
@@ -0,0 +1,81 @@
+import logging
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# (collection, keys, options) backing the hot find().sort() paths
+INDEXES = [
+    ("sensordata", [("userId", 1), ("ts", -1)], {}),
+    # every readiness window and the nudge steps average in rules.py / system_function.py
+    ("sensordata", [("userId", 1), ("metricType", 1), ("ts", -1)], {}),
+    # one Steps rollup per day; only docs carrying a 'date' key participate
+    ("sensordata", [("userId", 1), ("metricType", 1), ("date", 1)],
+     {"unique": True, "partialFilterExpression": {"date": {"$exists": True}}}),
+    # also walked backwards for next_best_intensity's latest-plan lookup
+    ("plans", [("userId", 1), ("date", 1)], {"unique": True}),
+    ("recommendations", [("userId", 1), ("ts", -1)], {}),
+    ("goals", [("userId", 1), ("createdAt", -1)], {}),
+    # legacy goals addressed by string 'id'; newer goals only carry _id
+    ("goals", [("userId", 1), ("id", 1)],
+     {"unique": True, "partialFilterExpression": {"id": {"$exists": True}}}),
+    ("videos", [("id", 1)], {"unique": True}),
+    ("videos", [("ts", -1)], {}),
+]
+
+class IndexSetupError(RuntimeError):
+    """A unique index could not be built; upserts keyed on it would not be race-safe."""
+
+def _dedupe(coll, keys, opts):
+    """Delete all but the newest doc (by _id) of each duplicated key. Returns how many went."""
+    fields = [k for k, _ in keys]
+    pipeline = [{"$match": opts["partialFilterExpression"]}] if "partialFilterExpression" in opts else []
+    pipeline += [
+        {"$sort": {"_id": -1}},
+        {"$group": {"_id": {f: f"${f}" for f in fields}, "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ]
+    stale = [i for d in coll.aggregate(pipeline, allowDiskUse=True) for i in d["ids"][1:]]
+    if stale:
+        coll.delete_many({"_id": {"$in": stale}})
+    return len(stale)
+
+def _migrate_to_unique(coll, keys, opts):
+    """
+    Older deploys built some of these keys as plain indexes under the same
+    auto-generated name, so create_index(unique=True) would hit an options
+    conflict. De-duplicate the keys and drop the old index so it can be rebuilt.
+    """
+    old = next((ix for ix in coll.list_indexes() if list(ix["key"].items()) == keys), None)
+    if old is None or old.get("unique"):
+        return
+    removed = _dedupe(coll, keys, opts)
+    logger.warning(f"Rebuilding {coll.name}.{old['name']} as unique; removed {removed} duplicate docs")
+    try:
+        coll.drop_index(old["name"])
+    except OperationFailure as e:
+        if e.code != 27:  # IndexNotFound: another worker dropped it first
+            raise
+
+def ensure_indexes(db):
+    """
+    Create INDEXES on `db`; create_index is a no-op for ones that already exist.
+    Raises IndexSetupError if the server refuses a unique index.
+    """
+    failed = []
+    # one failure (e.g. no createIndex privilege) must not skip the rest
+    for coll, keys, opts in INDEXES:
+        try:
+            if opts.get("unique"):
+                _migrate_to_unique(db[coll], keys, opts)
+            db[coll].create_index(keys, **opts)
+        except OperationFailure as e:
+            if not opts.get("unique"):
+                logger.warning(f"Failed to create index {coll}{keys}: {e}")
+                continue
+            logger.error(f"Failed to create unique index {coll}{keys}: {e}")
+            failed.append(f"{coll}{keys}")
+        except Exception as e:
+            logger.warning(f"Failed to create index {coll}{keys}: {e}")
+    if failed:
+        raise IndexSetupError(f"unique indexes missing: {', '.join(failed)}")
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from datetime import datetime, date
+from datetime import datetime, date, timezone
 from typing import Any, Dict, List, Optional, Union
 
 # Type alias for numeric values
@@ -7,8 +7,15 @@ Number = Union[int, float]
 
 # ---- helpers ----
 
-def iso_today() -> str:
-    return date.today().isoformat()
+def _utcnow() -> datetime:
+    # aware UTC; datetime.utcnow() is deprecated and returns a naive value
+    return datetime.now(timezone.utc)
+
+def iso_today(today: Optional[date] = None) -> str:
+    return (today or date.today()).isoformat()
+
+# metric type → coercer; anything not listed is tried as float
+_COERCERS = {"Steps": int, "HR": float, "SleepScore": float}
 
 def _coerce_metric_value(metric_type: str, value: Any) -> Number:
     """
@@ -16,17 +23,18 @@ def _coerce_metric_value(metric_type: str, value: Any) -> Number:
     Steps → int, HR/SleepScore → float, else try float.
     """
     try:
-        if metric_type == "Steps":
-            return int(value)
-        if metric_type in {"HR", "SleepScore"}:
-            return float(value)
-        return float(value)
+        return _COERCERS.get(metric_type, float)(value)
     except (TypeError, ValueError):
         return value  # Last resort fallback — caller must guard
 
 # ---- document factories ----
 
-def user_doc(user_id: str = "U123", name: str = "Demo User") -> Dict[str, Any]:
+def user_doc(
+    user_id: str = "U123",
+    name: str = "Demo User",
+    *,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
     return {
         "userId": user_id,
         "name": name,
@@ -34,7 +42,7 @@ def user_doc(user_id: str = "U123", name: str = "Demo User") -> Dict[str, Any]:
             "daysPerWeek": 4,
             "equip": ["bodyweight", "dumbbells"]
         },
-        "createdAt": datetime.utcnow(),
+        "createdAt": now or _utcnow(),
     }
 
 def sensordata_doc(
@@ -48,7 +56,7 @@ def sensordata_doc(
     doc = {
         "userId": user_id,
         "deviceId": device_id,
-        "ts": ts or datetime.utcnow(),
+        "ts": ts or _utcnow(),
         "metricType": metric_type,
         "value": _coerce_metric_value(metric_type, value),
     }
@@ -96,7 +104,7 @@ def feedback_doc(
         "mood": mood,
         "pain": pain,
         "notes": notes,
-        "ts": ts or datetime.utcnow(),
+        "ts": ts or _utcnow(),
     }
 
 def recommendation_doc(
@@ -109,5 +117,5 @@ def recommendation_doc(
         "userId": user_id,
         "message": message,
         "context": context,
-        "ts": ts or datetime.utcnow(),
+        "ts": ts or _utcnow(),
     }
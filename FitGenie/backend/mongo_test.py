@@ -14,7 +14,15 @@ if not mongo_uri:
 
 try:
     # Initialize client
-    client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)  # 5 second timeout
+    # one-shot check: a tiny pool, and the same wire compression the app negotiates
+    client = MongoClient(
+        mongo_uri,
+        serverSelectionTimeoutMS=5000,  # 5 second timeout
+        maxPoolSize=2,
+        minPoolSize=0,
+        retryWrites=True,
+        compressors="zstd,zlib",
+    )
     # Force connection on a request as the connect=True parameter of MongoClient seems useless here
     print("✅ Connected to MongoDB!")
     print("📦 Databases:", client.list_database_names())
@@ -1,12 +1,20 @@
-from datetime import datetime, timedelta, date
-from statistics import mean
+import threading
+from datetime import datetime, timedelta, timezone, date
+
+from cachetools import TTLCache
 
 # Configurable defaults
 DEFAULT_HR_BASELINE = 75.0
 DEFAULT_SLEEP_SCORE_BASELINE = 70.0
 
-def _clamp(x, lo=0.1, hi=1.0):
-    return max(lo, min(hi, x))
+def _readiness_kernel(hr_baseline, hr_avg, sleep_avg):
+    """Scalar readiness math: HR ↓ is better, SleepScore ↑ is better."""
+    # both scores clamped to [0.1, 1.0] inline, no helper call per score
+    hr_score = 0.5 + (hr_baseline - hr_avg) / 20.0  # normalize ±20 bpm to [0,1]
+    hr_score = 0.1 if hr_score < 0.1 else (1.0 if hr_score > 1.0 else hr_score)
+    sleep_score = sleep_avg / 100.0
+    sleep_score = 0.1 if sleep_score < 0.1 else (1.0 if sleep_score > 1.0 else sleep_score)
+    return round(0.4 * hr_score + 0.6 * sleep_score, 2)
 
 class BehaviorModel:
     """
@@ -16,87 +24,138 @@ class BehaviorModel:
     - next_best_intensity(): suggested level with hysteresis for stability
     """
     
-    def __init__(self, db):
+    def __init__(self, db, score_ttl=60):
         self.db = db
-
-    def _recent_plans(self, user_id, days=7):
+        # scores move slowly; a burst (week regenerate, nudge + plan) reuses them.
+        # userId -> {score name: value}, so invalidate() drops a user in one pop
+        self._scores = TTLCache(maxsize=10000, ttl=score_ttl)
+        self._scores_lock = threading.Lock()
+
+    def _cached_score(self, user_id, name, compute):
+        with self._scores_lock:
+            hit = self._scores.get(user_id, {}).get(name)
+        if hit is None:
+            hit = compute()
+            with self._scores_lock:
+                entry = self._scores.get(user_id)
+                if entry is None:
+                    entry = self._scores[user_id] = {}
+                entry[name] = hit
+        return hit
+
+    def invalidate(self, user_id):
+        """Forget cached scores after a write that changes them (e.g. a plan completed)."""
+        with self._scores_lock:
+            self._scores.pop(user_id, None)
+
+    def _plan_counts(self, user_id, days=7):
+        """(total, completed) plans since `days` ago, counted server-side."""
         since_str = (date.today() - timedelta(days=days)).isoformat()
-        cur = self.db.plans.find(
-            {"userId": user_id, "date": {"$gte": since_str}},
-            {"_id": 0, "status": 1, "date": 1}
-        )
-        return list(cur)
-
-    def _values(self, user_id, metric, hours=24, limit=500):
-        """Fetch numeric metric values in a window; ignore non-numeric."""
-        since = datetime.utcnow() - timedelta(hours=hours)
-        cur = self.db.sensordata.find(
-            {"userId": user_id, "metricType": metric, "ts": {"$gte": since}},
-            {"_id": 0, "value": 1, "ts": 1}
-        ).sort("ts", -1).limit(limit)
-        vals = []
-        for d in cur:
-            try:
-                vals.append(float(d["value"]))
-            except (ValueError, TypeError, KeyError):
-                continue
-        return vals
+        res = next(self.db.plans.aggregate([
+            {"$match": {"userId": user_id, "date": {"$gte": since_str}}},
+            {"$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "completed": {"$sum": {"$cond": [{"$eq": ["$status", "Completed"]}, 1, 0]}},
+            }},
+        ]), None)
+        return (res["total"], res["completed"]) if res else (0, 0)
+
+    def _metric_averages(self, user_id, limit=500):
+        """
+        All four readiness windows in one round trip: average of the latest
+        numeric values (non-numeric ignored) per window, None when a window
+        has no samples. Each window is its own $unionWith branch so it keeps
+        the (userId, metricType, ts) index and its limit instead of scanning
+        the whole 14 days.
+        """
+        now = datetime.now(timezone.utc)
+
+        def window(key, metric, hours, n):
+            return [
+                {"$match": {"userId": user_id, "metricType": metric,
+                            "ts": {"$gte": now - timedelta(hours=hours)}}},
+                {"$sort": {"ts": -1}},
+                {"$limit": n},
+                {"$group": {"_id": key, "avg": {"$avg": {
+                    "$convert": {"input": "$value", "to": "double", "onError": None, "onNull": None}
+                }}}},
+            ]
+
+        pipeline = window("hr_base", "HR", 24 * 14, limit) + [
+            {"$unionWith": {"coll": "sensordata", "pipeline": p}} for p in (
+                window("sleep_base", "SleepScore", 24 * 14, limit),
+                window("hr_recent", "HR", 24, limit),
+                window("sleep_recent", "SleepScore", 24 * 7, 3),  # latest 3 scores
+            )
+        ]
+        return {d["_id"]: d["avg"] for d in self.db.sensordata.aggregate(pipeline)}
 
     def adherence_score(self, user_id, days=7):
-        plans = self._recent_plans(user_id, days)
-        if not plans:
+        return self._cached_score(user_id, ("adherence", days),
+                                  lambda: self._adherence(user_id, days))
+
+    def _adherence(self, user_id, days):
+        total, completed = self._plan_counts(user_id, days)
+        if not total:
             return 0.5  # neutral fallback
-        completed = sum(1 for p in plans if p.get("status") == "Completed")
-        return completed / len(plans)
+        return completed / total
 
     def readiness_score(self, user_id):
-        # Baseline data from past 14 days
-        hr_base_vals = self._values(user_id, "HR", hours=24 * 14)
-        sleep_base_vals = self._values(user_id, "SleepScore", hours=24 * 14)
-
-        hr_baseline = mean(hr_base_vals) if hr_base_vals else DEFAULT_HR_BASELINE
-        sleep_baseline = mean(sleep_base_vals) if sleep_base_vals else DEFAULT_SLEEP_SCORE_BASELINE
+        return self._cached_score(user_id, "readiness",
+                                  lambda: self._readiness(user_id))
 
-        # Recent HR and SleepScore
-        hr_recent = self._values(user_id, "HR", hours=24)
-        sleep_recent = self._values(user_id, "SleepScore", hours=24 * 7)[:3]  # take latest 3 scores
+    def _readiness(self, user_id):
+        avgs = self._metric_averages(user_id)
 
-        hr_avg = mean(hr_recent) if hr_recent else hr_baseline
-        sleep_avg = mean(sleep_recent) if sleep_recent else sleep_baseline
-
-        # Normalize: HR ↓ is better, SleepScore ↑ is better
-        hr_delta = hr_baseline - hr_avg
-        hr_score = _clamp(0.5 + (hr_delta / 20.0))  # normalize ±20 bpm to [0,1]
-        sleep_score = _clamp(sleep_avg / 100.0)
-
-        readiness = round(0.4 * hr_score + 0.6 * sleep_score, 2)
-        return readiness
+        # Baseline data from past 14 days
+        hr_baseline = avgs.get("hr_base")
+        if hr_baseline is None:
+            hr_baseline = DEFAULT_HR_BASELINE
+        sleep_baseline = avgs.get("sleep_base")
+        if sleep_baseline is None:
+            sleep_baseline = DEFAULT_SLEEP_SCORE_BASELINE
+
+        # Recent HR (24h) and SleepScore (latest 3 in 7d)
+        hr_avg = avgs.get("hr_recent")
+        if hr_avg is None:
+            hr_avg = hr_baseline
+        sleep_avg = avgs.get("sleep_recent")
+        if sleep_avg is None:
+            sleep_avg = sleep_baseline
+
+        return _readiness_kernel(hr_baseline, hr_avg, sleep_avg)
 
     def next_best_intensity(self, user_id):
+        return self._cached_score(user_id, "intensity",
+                                  lambda: self._next_best_intensity(user_id))
+
+    def _next_best_intensity(self, user_id):
         readiness = self.readiness_score(user_id)
-        adherence = self.adherence_score(user_id)
 
-        # Initial suggestion
-        if readiness > 0.8 and adherence >= 0.6:
+        # Initial suggestion; adherence only matters on the High branch, so it's looked up there
+        if readiness > 0.8 and self.adherence_score(user_id) >= 0.6:
             target = "High"
         elif readiness >= 0.6:
             target = "Moderate"
         else:
             target = "Low"
 
-        # Hysteresis to prevent large jumps
+        # hysteresis can only pull High/Low back to Moderate
+        if target == "Moderate":
+            return target
+
+        # Hysteresis to prevent large jumps.
+        # $elemMatch keeps only the latest plan's first Workout item (items is absent if none)
         last_plan = self.db.plans.find_one(
             {"userId": user_id},
             sort=[("date", -1)],
-            projection={"_id": 0, "items": 1}
+            projection={"_id": 0, "items": {"$elemMatch": {"type": "Workout"}}}
         )
 
         last_intensity = None
         if last_plan and last_plan.get("items"):
-            for item in last_plan["items"]:
-                if item.get("type") == "Workout":
-                    last_intensity = item.get("intensity")
-                    break
+            last_intensity = last_plan["items"][0].get("intensity")
 
         if last_intensity:
             order = {"Low": 0, "Moderate": 1, "High": 2}
@@ -1,13 +1,34 @@
 import logging
-from statistics import mean
+from pymongo import UpdateOne
 from models import plan_item, plan_doc, recommendation_doc, iso_today
 
 logger = logging.getLogger(__name__)
 
 LOW_STEP_THRESHOLD = 300
 MODERATE_STEP_THRESHOLD = 2000
+PLAN_BATCH_SIZE = 1000  # upserts per bulk_write in generate_plans_batch
 
-def generate_plan(user, behavior_model, db):
+# built once; generate_plan copies the chosen items so callers can't mutate these
+BASE_PLANS = {
+    "Low": (
+        plan_item("Workout", "Low", 20, "Light mobility + walk"),
+        plan_item("Habit", "Low", 5, "Hydrate: +1L"),
+        plan_item("Recovery", "Low", 10, "Stretch + sleep target 8h"),
+    ),
+    "Moderate": (
+        plan_item("Workout", "Moderate", 35, "Bodyweight circuit + brisk walk"),
+        plan_item("Habit", "Low", 5, "2L water + protein target"),
+        plan_item("Recovery", "Low", 10, "Cooldown + mindfulness 5m"),
+    ),
+    "High": (
+        plan_item("Workout", "High", 45, "Intervals + strength"),
+        plan_item("Habit", "Low", 5, "Macros check + 2.5L water"),
+        plan_item("Recovery", "Low", 15, "Mobility + sleep hygiene"),
+    ),
+}
+
+def build_plan(user, behavior_model, date_str=None):
+    """`user`'s plan doc for `date_str` (default today), not stored, and the intensity it was built with."""
     user_id = user["userId"]
 
     try:
@@ -16,50 +37,62 @@ def generate_plan(user, behavior_model, db):
         logger.warning(f"Failed to fetch intensity for user {user_id}: {e}")
         intensity = "Moderate"
 
-    base = {
-        "Low": [
-            plan_item("Workout", "Low", 20, "Light mobility + walk"),
-            plan_item("Habit", "Low", 5, "Hydrate: +1L"),
-            plan_item("Recovery", "Low", 10, "Stretch + sleep target 8h"),
-        ],
-        "Moderate": [
-            plan_item("Workout", "Moderate", 35, "Bodyweight circuit + brisk walk"),
-            plan_item("Habit", "Low", 5, "2L water + protein target"),
-            plan_item("Recovery", "Low", 10, "Cooldown + mindfulness 5m"),
-        ],
-        "High": [
-            plan_item("Workout", "High", 45, "Intervals + strength"),
-            plan_item("Habit", "Low", 5, "Macros check + 2.5L water"),
-            plan_item("Recovery", "Low", 15, "Mobility + sleep hygiene"),
-        ],
-    }
-
-    items = base.get(intensity, base["Moderate"])
+    items = [dict(it) for it in BASE_PLANS.get(intensity, BASE_PLANS["Moderate"])]
 
     plan = plan_doc(
         user_id=user_id,
         items=items,
-        date=iso_today(),
+        date=date_str or iso_today(),
         status="Proposed"
     )
+    return plan, intensity
 
-    db.plans.update_one(
-        {"userId": user_id, "date": plan["date"]},
-        {"$set": plan},
-        upsert=True
-    )
+def plan_upsert(plan):
+    """Bulk upsert op storing `plan` under its (userId, date) key."""
+    return UpdateOne({"userId": plan["userId"], "date": plan["date"]}, {"$set": plan}, upsert=True)
+
+def generate_plan(user, behavior_model, db):
+    plan, intensity = build_plan(user, behavior_model)
+    user_id = user["userId"]
+
+    db.plans.bulk_write([plan_upsert(plan)])
 
     logger.info(f"Generated plan for user {user_id} with intensity '{intensity}'")
     return plan
 
+def generate_plans_batch(users, behavior_model, db):
+    """
+    Generate and store today's plan for many users (e.g. a nightly job),
+    upserting PLAN_BATCH_SIZE plans per unordered bulk_write instead of one
+    round trip per user. Returns the number of plans written.
+    """
+    today = iso_today()  # one date for the whole run, even across midnight
+    ops, written = [], 0
+    for user in users:
+        plan, _ = build_plan(user, behavior_model, today)
+        ops.append(plan_upsert(plan))
+        if len(ops) >= PLAN_BATCH_SIZE:
+            db.plans.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        db.plans.bulk_write(ops, ordered=False)
+        written += len(ops)
+    logger.info(f"Generated {written} plans in batch")
+    return written
 
-def generate_nudges(user_id, behavior_model, db):
-    cursor = db.sensordata.find(
-        {"userId": user_id, "metricType": "Steps"}
-    ).sort("ts", -1).limit(6)
 
-    recent_steps = [int(m["value"]) for m in cursor if "value" in m]
-    avg = int(mean(recent_steps)) if recent_steps else 0
+def generate_nudges(user_id, behavior_model, db):
+    # mean of the last 6 Steps samples, computed server-side (one doc back instead of six)
+    res = next(db.sensordata.aggregate([
+        {"$match": {"userId": user_id, "metricType": "Steps"}},
+        {"$sort": {"ts": -1}},
+        {"$limit": 6},
+        {"$group": {"_id": None, "avg": {"$avg": {
+            "$convert": {"input": "$value", "to": "int", "onError": None, "onNull": None}
+        }}}},
+    ]), None)
+    avg = int(res["avg"]) if res and res["avg"] is not None else 0
 
     if avg < LOW_STEP_THRESHOLD:
         msg = "Quick win: 10-minute brisk walk to boost your step count."
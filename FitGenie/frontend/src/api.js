@@ -16,7 +16,16 @@ export const login = (userId = "U123", name = "Demo User") =>
   API.post("/auth/login", { userId, name });
 
 // -------- Daily plan + actions --------
-export const getPlan      = () => API.get("/me/plan").then((r) => r.data);
+// 202 means today's plan is still being generated server-side; poll briefly.
+// Resolves to null if it never shows up, so callers don't render the status stub as a plan.
+export const getPlan = async (tries = 10) => {
+  for (let i = 1; ; i++) {
+    const r = await API.get("/me/plan");
+    if (r.status !== 202) return r.data;
+    if (i >= tries) return null;
+    await new Promise((res) => setTimeout(res, 500));
+  }
+};
 export const startPlan    = () => API.post("/me/plan/start").then((r) => r.data);
 export const completePlan = () => API.post("/me/plan/complete").then((r) => r.data);
 
@@ -1,16 +1,35 @@
 import time, random, requests, os
+from requests.adapters import HTTPAdapter
 
-API = os.getenv("API","https://turbo-space-dollop-977gxxjj565qf95r9-5000.app.github.dev/")
+API = os.getenv("API","https://turbo-space-dollop-977gxxjj565qf95r9-5000.app.github.dev/").rstrip("/")
 HEADERS = {"X-User-Id":"U123"}
+# ticks per POST; the server stamps samples on receipt, so a batch shares one ts
+FLUSH_EVERY = int(os.getenv("FLUSH_EVERY", 1))
+# own generator (SIM_SEED makes a run reproducible); bound methods hoisted out of the loop
+rng = random.Random(os.getenv("SIM_SEED"))
+randint, chance = rng.randint, rng.random
 
-def push(metric, val):
-    requests.post(f"{API}/me/metrics", json={"metricType": metric, "value": val}, headers=HEADERS, timeout=5)
+# one kept-alive connection instead of a fresh TCP/TLS handshake per sample
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+def push_batch(samples):
+    # /me/metrics accepts a JSON array and inserts it with one insert_many;
+    # nothing here reads the samples back, so skip waiting for the write ack
+    session.post(f"{API}/me/metrics", params={"fast_insert": 1}, json=samples,
+                 headers=HEADERS, timeout=5)
 
 if __name__ == "__main__":
     print("Simulating sensor data → Ctrl+C to stop")
+    batch, ticks = [], 0
     while True:
-        push("HR", random.randint(70, 95))
-        push("Steps", random.randint(100, 800))
-        if random.random() < .3:
-            push("SleepScore", random.randint(60, 85))
+        batch.append({"metricType": "HR", "value": randint(70, 95)})
+        batch.append({"metricType": "Steps", "value": randint(100, 800)})
+        if chance() < .3:
+            batch.append({"metricType": "SleepScore", "value": randint(60, 85)})
+        ticks += 1
+        if ticks >= FLUSH_EVERY:
+            push_batch(batch)
+            batch, ticks = [], 0
         time.sleep(5)